@@ -1,19 +1,129 @@
+import asyncio
 import sqlite3
+import threading
+import queue
+from contextlib import contextmanager
 from datetime import datetime, date
 import os
-from typing import Optional, List, Dict, Any
+import time
+from typing import Optional, List, Dict, Any, Iterator
+
+READ_POOL_SIZE = 4
+STATEMENT_CACHE_SIZE = 128
+USER_CACHE_TTL = 60  # seconds
+
+_SQL_CREATE_USER = 'INSERT OR IGNORE INTO users (user_id, username, created_at) VALUES (?, ?, ?)'
+_SQL_GET_USER = 'SELECT * FROM users WHERE user_id = ?'
+# Meals are clustered by user, so ids are assigned per user rather than globally
+_SQL_MEALS_TABLE = '''
+    CREATE TABLE IF NOT EXISTS {name} (
+        user_id INTEGER NOT NULL,
+        id INTEGER NOT NULL,
+        food_name TEXT NOT NULL,
+        calories REAL NOT NULL,
+        meal_type TEXT NOT NULL,
+        photo_url TEXT,
+        created_at TEXT NOT NULL,
+        meal_date TEXT GENERATED ALWAYS AS (substr(created_at, 1, 10)) STORED,
+        PRIMARY KEY (user_id, id),
+        FOREIGN KEY (user_id) REFERENCES users (user_id)
+    ) WITHOUT ROWID
+'''
+# Placeholder users for rows written before foreign keys were enforced
+_SQL_BACKFILL_USERS = '''INSERT OR IGNORE INTO users (user_id, username, created_at)
+                         SELECT user_id, CAST(user_id AS TEXT), MIN(created_at)
+                         FROM (SELECT user_id, created_at FROM meals
+                               UNION ALL
+                               SELECT user_id, created_at FROM daily_logs)
+                         GROUP BY user_id'''
+_SQL_INSERT_MEAL = '''INSERT INTO meals (user_id, id, food_name, calories, meal_type, photo_url, created_at)
+                      VALUES (?, (SELECT COALESCE(MAX(id), 0) + 1 FROM meals WHERE user_id = ?),
+                              ?, ?, ?, ?, ?)'''
+_SQL_DAILY_MEALS = '''SELECT * FROM meals 
+                      WHERE user_id = ? AND meal_date = ?
+                      ORDER BY created_at'''
+# Pinned: a database that was empty at startup has no statistics, and the
+# planner would otherwise walk the user's whole (user_id, id) primary key.
+# This index also carries calories, so the sum never reads the table.
+_SQL_DAILY_SUM = '''SELECT COALESCE(SUM(calories), 0) FROM meals INDEXED BY idx_meals_date_user
+                    WHERE user_id = ? AND meal_date = ?'''
+# Pinned for the same reason as _SQL_DAILY_SUM
+_SQL_HAS_MEALS = '''SELECT EXISTS(SELECT 1 FROM meals INDEXED BY idx_meals_user_date
+                    WHERE user_id = ? AND meal_date = ? LIMIT 1)'''
+_SQL_ALL_DAILY_TOTALS = '''SELECT user_id, COALESCE(SUM(calories), 0) AS total FROM meals
+                           WHERE meal_date = ?
+                           GROUP BY user_id'''
+_SQL_ALL_USERS = 'SELECT * FROM users'
+_SQL_REMINDER_USERS = 'SELECT * FROM users WHERE reminder_enabled = 1'
+_SQL_UPDATE_SETTINGS_TEMPLATE = 'UPDATE users SET {} WHERE user_id = ?'
+_SQL_INSERT_DAILY_LOG = '''INSERT INTO daily_logs 
+                           (user_id, date, total_calories, target_met, created_at)
+                           VALUES (?, ?, ?, ?, ?)'''
+_SQL_GET_FOOD_CACHE = 'SELECT name, calories, fetched_at FROM food_cache WHERE query = ? AND fetched_at > ?'
+_SQL_SET_FOOD_CACHE = 'INSERT OR REPLACE INTO food_cache (query, name, calories, fetched_at) VALUES (?, ?, ?, ?)'
+
+def _utc_today() -> date:
+    """Today's date on the UTC clock that stamps created_at (and so meal_date)."""
+    return datetime.utcnow().date()
 
 class Database:
     def __init__(self):
         self.db_path = os.path.join(os.path.dirname(__file__), '..', 'data', 'calories.db')
         os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+
+        # WAL allows a single writer alongside any number of readers
+        self._write_conn = self._connect()
+        self._write_lock = threading.Lock()
+        self._update_settings_sql: Dict[frozenset, str] = {}
+        self._user_cache: Dict[int, tuple[float, Optional[Dict[str, Any]]]] = {}
+        self._user_cache_ttl = USER_CACHE_TTL
+        self._today_totals: Dict[int, tuple[date, float]] = {}
         self.init_db()
 
+        self._read_pool = queue.Queue()
+        for _ in range(READ_POOL_SIZE):
+            self._read_pool.put(self._connect())
+
+    def _connect(self) -> sqlite3.Connection:
+        """Open a connection with the per-connection PRAGMAs applied."""
+        conn = sqlite3.connect(
+            self.db_path,
+            check_same_thread=False,
+            isolation_level=None,
+            cached_statements=STATEMENT_CACHE_SIZE
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA busy_timeout = 5000')
+        conn.execute('PRAGMA synchronous = NORMAL')
+        conn.execute('PRAGMA temp_store = MEMORY')
+        conn.execute('PRAGMA cache_size = -65536')  # 64 MB
+        conn.execute('PRAGMA foreign_keys = ON')
+        conn.execute('PRAGMA wal_autocheckpoint = 1000')
+        return conn
+
+    @contextmanager
+    def _writer(self) -> Iterator[sqlite3.Connection]:
+        """Hold the shared write connection for the duration of the block."""
+        with self._write_lock:
+            yield self._write_conn
+
+    @contextmanager
+    def _reader(self) -> Iterator[sqlite3.Connection]:
+        """Borrow a read connection from the pool."""
+        conn = self._read_pool.get()
+        try:
+            yield conn
+        finally:
+            self._read_pool.put(conn)
+
     def init_db(self):
         """Initialize the database with required tables."""
-        with sqlite3.connect(self.db_path) as conn:
+        with self._writer() as conn:
             cursor = conn.cursor()
             
+            # WAL is persistent in the database file, so it only needs setting once
+            cursor.execute('PRAGMA journal_mode = WAL')
+            
             # Create users table
             cursor.execute('''
                 CREATE TABLE IF NOT EXISTS users (
@@ -26,18 +136,7 @@ class Database:
             ''')
             
             # Create meals table
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS meals (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    food_name TEXT NOT NULL,
-                    calories REAL NOT NULL,
-                    meal_type TEXT NOT NULL,
-                    photo_url TEXT,
-                    created_at TEXT NOT NULL,
-                    FOREIGN KEY (user_id) REFERENCES users (user_id)
-                )
-            ''')
+            cursor.execute(_SQL_MEALS_TABLE.format(name='meals'))
             
             # Create daily_logs table
             cursor.execute('''
@@ -51,90 +150,278 @@ class Database:
                     FOREIGN KEY (user_id) REFERENCES users (user_id)
                 )
             ''')
-            
-            conn.commit()
+
+            # Runs once every table its foreign key check covers exists
+            self._migrate_meals_table(cursor)
+
+            # Create food_cache table for calorie lookups that survive restarts
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS food_cache (
+                    query TEXT PRIMARY KEY,
+                    name TEXT NOT NULL,
+                    calories REAL NOT NULL,
+                    fetched_at INTEGER NOT NULL
+                ) WITHOUT ROWID
+            ''')
+
+            # Indexes for the per-user, per-day lookups
+            cursor.execute('DROP INDEX IF EXISTS idx_meals_user_created')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_meals_user_date
+                ON meals (user_id, meal_date, created_at)
+            ''')
+            # The nightly all-users total filters on meal_date alone; with
+            # calories in the index it never touches the table
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_meals_date_user
+                ON meals (meal_date, user_id, calories)
+            ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_daily_logs_user_date
+                ON daily_logs (user_id, date)
+            ''')
+
+            # Without statistics the planner treats the (user_id, id) primary
+            # key as good as idx_meals_user_date and scans a user's whole
+            # history; a bounded ANALYZE on every start keeps the stats fresh
+            cursor.execute('PRAGMA analysis_limit = 1000')
+            cursor.execute('ANALYZE')
+
+    def _migrate_meals_table(self, cursor: sqlite3.Cursor) -> None:
+        """Rebuild an older meals table into the current layout.
+
+        Covers legacy rowid tables and WITHOUT ROWID tables whose meal_date
+        is still a VIRTUAL generated column.
+        """
+        cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'meals'")
+        without_rowid = 'WITHOUT ROWID' in cursor.fetchone()['sql'].upper()
+        # table_xinfo reports hidden = 3 for STORED generated columns
+        cursor.execute('PRAGMA table_xinfo(meals)')
+        stored_date = any(
+            row['name'] == 'meal_date' and row['hidden'] == 3 for row in cursor.fetchall()
+        )
+        if without_rowid and stored_date:
+            return
+        
+        # Follows SQLite's table rebuild procedure: foreign keys go off before
+        # the transaction starts (the PRAGMA is a no-op inside one), and are
+        # checked by hand before committing. Legacy databases never enforced
+        # them, so meals can belong to users who never ran /start.
+        cursor.execute('PRAGMA foreign_keys = OFF')
+        try:
+            cursor.execute('BEGIN IMMEDIATE')
+            try:
+                # Existing ids are globally unique, so they stay unique per user
+                cursor.execute('DROP TABLE IF EXISTS meals_new')
+                cursor.execute(_SQL_MEALS_TABLE.format(name='meals_new'))
+                cursor.execute('''
+                    INSERT INTO meals_new
+                        (user_id, id, food_name, calories, meal_type, photo_url, created_at)
+                    SELECT user_id, id, food_name, calories, meal_type, photo_url, created_at
+                    FROM meals
+                ''')
+                cursor.execute('DROP TABLE meals')
+                cursor.execute('ALTER TABLE meals_new RENAME TO meals')
+                
+                cursor.execute(_SQL_BACKFILL_USERS)
+                cursor.execute('PRAGMA foreign_key_check')
+                violations = cursor.fetchall()
+                if violations:
+                    raise sqlite3.IntegrityError(
+                        f"{len(violations)} foreign key violations left after migrating meals"
+                    )
+            except Exception:
+                cursor.execute('ROLLBACK')
+                raise
+            cursor.execute('COMMIT')
+        finally:
+            cursor.execute('PRAGMA foreign_keys = ON')
 
     def create_user(self, user_id: int, username: str) -> None:
         """Create a new user in the database."""
-        with sqlite3.connect(self.db_path) as conn:
+        with self._writer() as conn:
             cursor = conn.cursor()
             cursor.execute(
-                'INSERT OR IGNORE INTO users (user_id, username, created_at) VALUES (?, ?, ?)',
+                _SQL_CREATE_USER,
                 (user_id, username, datetime.utcnow().isoformat())
             )
-            conn.commit()
+        self._user_cache.pop(user_id, None)
 
     def get_user(self, user_id: int) -> Optional[Dict[str, Any]]:
-        """Get user information."""
-        with sqlite3.connect(self.db_path) as conn:
-            conn.row_factory = sqlite3.Row
-            cursor = conn.cursor()
-            cursor.execute('SELECT * FROM users WHERE user_id = ?', (user_id,))
-            row = cursor.fetchone()
-            return dict(row) if row else None
+        """Get user information, served from a short-lived cache when possible."""
+        now = time.monotonic()
+        cached = self._user_cache.get(user_id)
+        if cached is not None and now - cached[0] < self._user_cache_ttl:
+            user = cached[1]
+        else:
+            with self._reader() as conn:
+                cursor = conn.cursor()
+                cursor.execute(_SQL_GET_USER, (user_id,))
+                row = cursor.fetchone()
+            user = dict(row) if row else None
+            self._user_cache[user_id] = (now, user)
+        
+        # Hand out a copy so callers can't mutate the cached row
+        return dict(user) if user else None
+
+    def add_meal_and_get_total(self, user_id: int, username: str, food_name: str, calories: float, meal_type: str, photo_url: str = None) -> float:
+        """Add a new meal entry and return the user's total for today.
 
-    def add_meal(self, user_id: int, food_name: str, calories: float, meal_type: str, photo_url: str = None) -> None:
-        """Add a new meal entry."""
-        with sqlite3.connect(self.db_path) as conn:
+        Creates the user first if needed, since meals reference users and
+        logging a meal has never required /start.
+        """
+        # The running total is keyed on the same clock that dates the meal
+        now = datetime.utcnow()
+        today = now.date()
+        with self._writer() as conn:
             cursor = conn.cursor()
+            cursor.execute(_SQL_CREATE_USER, (user_id, username, now.isoformat()))
+            if cursor.rowcount:
+                self._user_cache.pop(user_id, None)
             cursor.execute(
-                '''INSERT INTO meals (user_id, food_name, calories, meal_type, photo_url, created_at)
-                   VALUES (?, ?, ?, ?, ?, ?)''',
-                (user_id, food_name, calories, meal_type, photo_url, datetime.utcnow().isoformat())
+                _SQL_INSERT_MEAL,
+                (user_id, user_id, food_name, calories, meal_type, photo_url, now.isoformat())
             )
-            conn.commit()
+            
+            # Keep a running total per user, seeded from the database once a day
+            cached = self._today_totals.get(user_id)
+            if cached is not None and cached[0] == today:
+                total = cached[1] + calories
+            else:
+                cursor.execute(_SQL_DAILY_SUM, (user_id, today.isoformat()))
+                total = cursor.fetchone()[0]
+            self._today_totals[user_id] = (today, total)
+        return total
 
     def get_daily_meals(self, user_id: int, day: date = None) -> List[Dict[str, Any]]:
         """Get all meals for a specific day."""
         if day is None:
-            day = date.today()
-        
-        start_date = f"{day.isoformat()}T00:00:00"
-        end_date = f"{day.isoformat()}T23:59:59"
+            day = _utc_today()
         
-        with sqlite3.connect(self.db_path) as conn:
-            conn.row_factory = sqlite3.Row
+        with self._reader() as conn:
             cursor = conn.cursor()
             cursor.execute(
-                '''SELECT * FROM meals 
-                   WHERE user_id = ? AND created_at BETWEEN ? AND ?
-                   ORDER BY created_at''',
-                (user_id, start_date, end_date)
+                _SQL_DAILY_MEALS,
+                (user_id, day.isoformat())
             )
             return [dict(row) for row in cursor.fetchall()]
 
-    def get_daily_total(self, user_id: int, day: date = None) -> float:
-        """Calculate total calories for a specific day."""
-        meals = self.get_daily_meals(user_id, day)
-        return sum(meal["calories"] for meal in meals)
+    def all_daily_totals(self, day: date = None) -> Dict[int, float]:
+        """Get every user's total calories for a specific day in one query."""
+        if day is None:
+            day = _utc_today()
+
+        with self._reader() as conn:
+            cursor = conn.cursor()
+            cursor.execute(_SQL_ALL_DAILY_TOTALS, (day.isoformat(),))
+            return {row['user_id']: row['total'] for row in cursor.fetchall()}
+
+    def get_all_users(self) -> List[Dict[str, Any]]:
+        """Get all users."""
+        with self._reader() as conn:
+            cursor = conn.cursor()
+            cursor.execute(_SQL_ALL_USERS)
+            return [dict(row) for row in cursor.fetchall()]
+
+    def user_has_meals_today(self, user_id: int) -> bool:
+        """Check whether the user has logged any meal today."""
+        with self._reader() as conn:
+            cursor = conn.cursor()
+            cursor.execute(_SQL_HAS_MEALS, (user_id, _utc_today().isoformat()))
+            return bool(cursor.fetchone()[0])
+
+    def get_reminder_users(self) -> List[Dict[str, Any]]:
+        """Get all users with reminders enabled."""
+        with self._reader() as conn:
+            cursor = conn.cursor()
+            cursor.execute(_SQL_REMINDER_USERS)
+            return [dict(row) for row in cursor.fetchall()]
 
     def update_settings(self, user_id: int, settings: dict) -> None:
         """Update user settings."""
-        with sqlite3.connect(self.db_path) as conn:
+        # Columns are always bound in sorted order so each distinct key set
+        # maps to exactly one SQL string
+        columns = sorted(settings)
+        cache_key = frozenset(columns)
+        query = self._update_settings_sql.get(cache_key)
+        if query is None:
+            query = _SQL_UPDATE_SETTINGS_TEMPLATE.format(
+                ', '.join(f"{column} = ?" for column in columns)
+            )
+            self._update_settings_sql[cache_key] = query
+        
+        params = [settings[column] for column in columns]
+        params.append(user_id)
+        
+        with self._writer() as conn:
             cursor = conn.cursor()
-            updates = []
-            params = []
-            for key, value in settings.items():
-                updates.append(f"{key} = ?")
-                params.append(value)
-            params.append(user_id)
-            
-            query = f"UPDATE users SET {', '.join(updates)} WHERE user_id = ?"
             cursor.execute(query, params)
-            conn.commit()
+        self._user_cache.pop(user_id, None)
 
-    def log_daily_summary(self, user_id: int, total_calories: float, target_met: bool) -> None:
-        """Log daily calorie summary."""
-        with sqlite3.connect(self.db_path) as conn:
+    def log_daily_summaries_bulk(self, rows: List[tuple]) -> None:
+        """Log many daily summaries in a single transaction.
+
+        Each row is (user_id, date, total_calories, target_met, created_at).
+        """
+        with self._writer() as conn:
             cursor = conn.cursor()
-            cursor.execute(
-                '''INSERT INTO daily_logs 
-                   (user_id, date, total_calories, target_met, created_at)
-                   VALUES (?, ?, ?, ?, ?)''',
-                (user_id, date.today().isoformat(), total_calories, 
-                 1 if target_met else 0, datetime.utcnow().isoformat())
-            )
-            conn.commit()
+            cursor.execute('BEGIN IMMEDIATE')
+            try:
+                cursor.executemany(_SQL_INSERT_DAILY_LOG, rows)
+            except Exception:
+                cursor.execute('ROLLBACK')
+                raise
+            cursor.execute('COMMIT')
+
+    def get_cached_food(self, query: str, min_fetched_at: int) -> Optional[tuple[str, float, int]]:
+        """Get a cached calorie lookup fetched after min_fetched_at (epoch seconds).
+
+        Returns (name, calories, fetched_at) so callers can keep the original age.
+        """
+        with self._reader() as conn:
+            cursor = conn.cursor()
+            cursor.execute(_SQL_GET_FOOD_CACHE, (query, min_fetched_at))
+            row = cursor.fetchone()
+            return (row['name'], row['calories'], row['fetched_at']) if row else None
+
+    def cache_food(self, query: str, name: str, calories: float, fetched_at: int) -> None:
+        """Store a calorie lookup result."""
+        with self._writer() as conn:
+            cursor = conn.cursor()
+            cursor.execute(_SQL_SET_FOOD_CACHE, (query, name, calories, fetched_at))
+
+    # Async variants run the blocking calls in a worker thread so handlers
+    # don't stall the event loop while SQLite does its work
+
+    async def acreate_user(self, user_id: int, username: str) -> None:
+        await asyncio.to_thread(self.create_user, user_id, username)
+
+    async def aget_user(self, user_id: int) -> Optional[Dict[str, Any]]:
+        return await asyncio.to_thread(self.get_user, user_id)
+
+    async def aadd_meal_and_get_total(self, user_id: int, username: str, food_name: str, calories: float, meal_type: str, photo_url: str = None) -> float:
+        return await asyncio.to_thread(self.add_meal_and_get_total, user_id, username, food_name, calories, meal_type, photo_url)
+
+    async def aget_daily_meals(self, user_id: int, day: date = None) -> List[Dict[str, Any]]:
+        return await asyncio.to_thread(self.get_daily_meals, user_id, day)
+
+    async def aall_daily_totals(self, day: date = None) -> Dict[int, float]:
+        return await asyncio.to_thread(self.all_daily_totals, day)
+
+    async def aget_all_users(self) -> List[Dict[str, Any]]:
+        return await asyncio.to_thread(self.get_all_users)
+
+    async def auser_has_meals_today(self, user_id: int) -> bool:
+        return await asyncio.to_thread(self.user_has_meals_today, user_id)
+
+    async def aget_reminder_users(self) -> List[Dict[str, Any]]:
+        return await asyncio.to_thread(self.get_reminder_users)
+
+    async def aupdate_settings(self, user_id: int, settings: dict) -> None:
+        await asyncio.to_thread(self.update_settings, user_id, settings)
+
+    async def alog_daily_summaries_bulk(self, rows: List[tuple]) -> None:
+        await asyncio.to_thread(self.log_daily_summaries_bulk, rows)
 
 # Initialize database connection
 db = Database() 
\ No newline at end of file
@@ -1,13 +1,24 @@
 import os
 import requests
+from requests.adapters import HTTPAdapter
 from PIL import Image
 from io import BytesIO
 from dotenv import load_dotenv
-from functools import lru_cache
+from database import db
+import heapq
+import threading
 import time
+from typing import BinaryIO
 
 load_dotenv()
 
+# Snap each channel to the centre of one of 8 levels, so a photo has at
+# most 8**3 = 512 distinct colors to rank
+COLOR_LEVELS = 8
+CACHE_MAXSIZE = 512
+_QUANTIZE_LUT = [v // (256 // COLOR_LEVELS) * (256 // COLOR_LEVELS) + 128 // COLOR_LEVELS
+                 for v in range(256)] * 3
+
 class FoodRecognition:
     def __init__(self):
         self.api_key = os.getenv("FOOD_API_KEY")
@@ -16,16 +27,23 @@ class FoodRecognition:
             'X-Api-Key': self.api_key,
             'Content-Type': 'application/json'
         }
+        # Keep-alive session so repeated lookups skip the TCP/TLS handshake
+        self._session = requests.Session()
+        self._session.headers.update(self.headers)
+        self._session.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=10))
         self.cache = {}
         self.cache_timeout = 3600  # 1 hour cache
+        self._cache_lock = threading.Lock()
 
-    def process_image(self, image_data: bytes) -> tuple[str, float]:
+    def process_image(self, image_file: BinaryIO) -> tuple[str, float]:
         """
         Process the image and return the recognized food and its calories.
-        Optimized version with basic image analysis.
+        Optimized version with basic image analysis. Reads straight from
+        the given binary stream, so the photo is never copied into bytes.
         """
         try:
-            image = Image.open(BytesIO(image_data))
+            # Opening only parses the header, so the size check needs no decode
+            image = Image.open(image_file)
             width, height = image.size
             
             if width < 100 or height < 100:
@@ -33,13 +51,19 @@ class FoodRecognition:
 
             # Quick image analysis for common colors
             # This is a simple optimization to avoid always returning "apple"
-            image = image.resize((100, 100))  # Reduce size for faster processing
-            colors = image.convert('RGB').getcolors(10000)
+            # Let libjpeg decode at a reduced scale, then shrink the rest of the way
+            image.draft('RGB', (128, 128))
+            image.thumbnail((64, 64), Image.Resampling.BILINEAR)
+            image = image.convert('RGB').point(_QUANTIZE_LUT)
+            colors = image.getcolors(COLOR_LEVELS ** 3)
             
             # Simple color-based food matching
             if colors:
-                dominant_colors = sorted(colors, key=lambda x: x[0], reverse=True)[:3]
-                avg_color = tuple(sum(c[1][i] for c in dominant_colors) // 3 for i in range(3))
+                dominant_colors = heapq.nlargest(3, colors, key=lambda x: x[0])
+                avg_color = tuple(
+                    sum(c[1][i] for c in dominant_colors) // len(dominant_colors)
+                    for i in range(3)
+                )
                 
                 # Very basic color matching
                 if avg_color[0] > 150 and avg_color[1] < 100 and avg_color[2] < 100:
@@ -62,22 +86,39 @@ class FoodRecognition:
         except Exception as e:
             return None, f"Error processing image: {str(e)}"
 
-    @lru_cache(maxsize=100)
+    def _remember(self, cache_key: str, timestamp: float, result: tuple[str, float]) -> None:
+        """Store a result in the in-memory cache, evicting the oldest entry once full."""
+        with self._cache_lock:
+            self.cache.pop(cache_key, None)
+            if len(self.cache) >= CACHE_MAXSIZE:
+                del self.cache[next(iter(self.cache))]
+            self.cache[cache_key] = (timestamp, result)
+
     def get_food_calories(self, query: str) -> tuple[str, float]:
         """Get calorie information for a food item with caching."""
         # Check internal cache first
         cache_key = query.lower()
         current_time = time.time()
         
-        if cache_key in self.cache:
-            timestamp, data = self.cache[cache_key]
-            if current_time - timestamp < self.cache_timeout:
-                return data
+        with self._cache_lock:
+            if cache_key in self.cache:
+                timestamp, data = self.cache[cache_key]
+                if current_time - timestamp < self.cache_timeout:
+                    return data
+                del self.cache[cache_key]
+
+        # Fall back to the persistent cache before going to the API
+        cached = db.get_cached_food(cache_key, int(current_time - self.cache_timeout))
+        if cached is not None:
+            name, calories, fetched_at = cached
+            # Keep the row's original age so the TTL still runs from the fetch
+            result = (name, calories)
+            self._remember(cache_key, fetched_at, result)
+            return result
 
         try:
-            response = requests.get(
+            response = self._session.get(
                 self.base_url,
-                headers=self.headers,
                 params={'query': query},
                 timeout=5  # Add timeout
             )
@@ -87,8 +128,9 @@ class FoodRecognition:
                 if data.get('items'):
                     item = data['items'][0]
                     result = (item['name'], item['calories'])
-                    # Update cache
-                    self.cache[cache_key] = (current_time, result)
+                    # Update both caches
+                    self._remember(cache_key, current_time, result)
+                    db.cache_food(cache_key, result[0], result[1], int(current_time))
                     return result
                 return None, "Food not found in database"
             else:
@@ -1,5 +1,7 @@
 import os
+import asyncio
 import logging
+from io import BytesIO
 from datetime import datetime
 from telegram import Update, ReplyKeyboardMarkup
 from telegram.ext import (
@@ -28,16 +30,23 @@ logger = logging.getLogger(__name__)
 # Conversation states
 FOOD_NAME, CALORIES = range(2)
 
+# Summary message templates
+_SUMMARY_HEADER = "📊 Today's Calorie Summary\n\n"
+_SUMMARY_NO_MEALS = "No meals logged today\n"
+_MEAL_LINE = "🍽 {name}: {cal:.1f} calories\n".format
+_SUMMARY_TOTAL = "\nTotal: {total:.1f} / {target} calories".format
+_SUMMARY_EXCEEDED = "\n⚠️ Daily target exceeded!"
+
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Start the bot and create user if not exists."""
     user = update.effective_user
     
     try:
         # Check if user exists
-        existing_user = db.get_user(user.id)
+        existing_user = await db.aget_user(user.id)
         if not existing_user:
             # Create new user
-            db.create_user(user.id, user.username or user.first_name)
+            await db.acreate_user(user.id, user.username or user.first_name)
             welcome_text = (
                 f"Welcome to CalorieTracker Bot, {user.first_name}! 🎉\n\n"
                 "I'll help you track your daily calorie intake.\n"
@@ -97,17 +106,16 @@ async def calories_received(update: Update, context: ContextTypes.DEFAULT_TYPE)
         calories = float(update.message.text)
         food_name = context.user_data['food_name']
         
-        # Add meal to database
-        db.add_meal(
-            user_id=update.effective_user.id,
+        # Add meal to database and get daily total
+        user = update.effective_user
+        daily_total = await db.aadd_meal_and_get_total(
+            user_id=user.id,
+            username=user.username or user.first_name,
             food_name=food_name,
             calories=calories,
             meal_type="manual"
         )
         
-        # Get daily total
-        daily_total = db.get_daily_total(update.effective_user.id)
-        
         await update.message.reply_text(
             f"✅ Logged {food_name} ({calories} calories)\n"
             f"Daily total: {daily_total:.1f} calories"
@@ -120,6 +128,13 @@ async def calories_received(update: Update, context: ContextTypes.DEFAULT_TYPE)
             "Please enter a valid number for calories."
         )
         return CALORIES
+        
+    except Exception as e:
+        logger.error(f"Error logging meal: {str(e)}")
+        await update.message.reply_text(
+            "Sorry, there was an error logging your meal. Please try again later."
+        )
+        return ConversationHandler.END
 
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Cancel the conversation."""
@@ -131,24 +146,30 @@ async def process_photo(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
     try:
         # Get the photo file
         photo = await update.message.photo[-1].get_file()
-        photo_data = await photo.download_as_bytearray()
+        # PTB still fetches the body as bytes and then writes it into the
+        # stream; this only drops the extra bytearray/BytesIO copy
+        photo_stream = BytesIO()
+        await photo.download_to_memory(out=photo_stream)
+        photo_stream.seek(0)
         
-        # Process the image
-        food_name, calories = food_recognition.process_image(photo_data)
+        # Process the image in a worker thread; decoding, the calorie
+        # caches and the API call all block
+        food_name, calories = await asyncio.to_thread(
+            food_recognition.process_image, photo_stream
+        )
         
         if food_name and calories:
-            # Add meal to database
-            db.add_meal(
-                user_id=update.effective_user.id,
+            # Add meal to database and get daily total
+            user = update.effective_user
+            daily_total = await db.aadd_meal_and_get_total(
+                user_id=user.id,
+                username=user.username or user.first_name,
                 food_name=food_name,
                 calories=calories,
                 meal_type="photo",
                 photo_url=photo.file_path
             )
             
-            # Get daily total
-            daily_total = db.get_daily_total(update.effective_user.id)
-            
             await update.message.reply_text(
                 f"📸 Recognized: {food_name}\n"
                 f"Estimated calories: {calories:.1f}\n"
@@ -171,7 +192,7 @@ async def summary(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Show daily calorie summary."""
     try:
         user_id = update.effective_user.id
-        user = db.get_user(user_id)
+        user = await db.aget_user(user_id)
         
         if not user:
             await update.message.reply_text(
@@ -179,28 +200,28 @@ async def summary(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
             )
             return
             
-        # Get daily meals and total
-        meals = db.get_daily_meals(user_id)
-        total_calories = db.get_daily_total(user_id)
+        # Get daily meals; the total falls out of the same rows
+        meals = await db.aget_daily_meals(user_id)
+        total_calories = sum(meal['calories'] for meal in meals)
         target = user.get('daily_target', 2000)
         
         # Create summary message
-        summary_text = "📊 Today's Calorie Summary\n\n"
+        parts = [_SUMMARY_HEADER]
         
         if meals:
-            for meal in meals:
-                summary_text += (
-                    f"🍽 {meal['food_name']}: {meal['calories']:.1f} calories\n"
-                )
+            parts.extend(
+                _MEAL_LINE(name=meal['food_name'], cal=meal['calories'])
+                for meal in meals
+            )
         else:
-            summary_text += "No meals logged today\n"
+            parts.append(_SUMMARY_NO_MEALS)
             
-        summary_text += f"\nTotal: {total_calories:.1f} / {target} calories"
+        parts.append(_SUMMARY_TOTAL(total=total_calories, target=target))
         
         if total_calories > target:
-            summary_text += "\n⚠️ Daily target exceeded!"
+            parts.append(_SUMMARY_EXCEEDED)
         
-        await update.message.reply_text(summary_text)
+        await update.message.reply_text(''.join(parts))
         
     except Exception as e:
         logger.error(f"Error showing summary: {str(e)}")
@@ -211,7 +232,7 @@ async def summary(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 async def settings(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Show and modify user settings."""
     try:
-        user = db.get_user(update.effective_user.id).data
+        user = await db.aget_user(update.effective_user.id)
         
         if not user:
             await update.message.reply_text(
@@ -252,7 +273,7 @@ async def set_target(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None
             )
             return
             
-        db.update_settings(
+        await db.aupdate_settings(
             update.effective_user.id,
             {"daily_target": target}
         )
@@ -270,10 +291,17 @@ async def set_target(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None
 async def toggle_reminders(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Toggle reminder settings."""
     try:
-        user = db.get_user(update.effective_user.id).data
+        user = await db.aget_user(update.effective_user.id)
+        
+        if not user:
+            await update.message.reply_text(
+                "Please use /start to set up your profile first."
+            )
+            return
+            
         current_setting = user.get('reminder_enabled', True)
         
-        db.update_settings(
+        await db.aupdate_settings(
             update.effective_user.id,
             {"reminder_enabled": not current_setting}
         )
@@ -288,12 +316,19 @@ async def toggle_reminders(update: Update, context: ContextTypes.DEFAULT_TYPE) -
             "Please try again later."
         )
 
+async def post_init(application: Application) -> None:
+    """Create and start the scheduler on the running event loop."""
+    scheduler = SchedulerService(application.bot)
+    scheduler.start()
+    application.bot_data['scheduler'] = scheduler
+
 def main() -> None:
     """Start the bot."""
     # Create application and configure to drop pending updates
     application = (
         Application.builder()
         .token(os.getenv("TELEGRAM_BOT_TOKEN"))
+        .post_init(post_init)
         .build()
     )
     
@@ -317,10 +352,6 @@ def main() -> None:
     application.add_handler(conv_handler)
     application.add_handler(MessageHandler(filters.PHOTO, process_photo))
     
-    # Create and start scheduler
-    scheduler = SchedulerService(application.bot)
-    scheduler.start()
-    
     # Start the bot with a higher poll interval and drop_pending_updates
     application.run_polling(drop_pending_updates=True, poll_interval=2.0)
 
@@ -1,12 +1,20 @@
-from datetime import datetime, time
-from apscheduler.schedulers.background import BackgroundScheduler
+import asyncio
+from datetime import datetime, time, timedelta
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.cron import CronTrigger
 from database import db
 
+# Upper bound on in-flight send_message calls, to stay under Telegram's rate limits
+MAX_CONCURRENT_SENDS = 20
+
+# Meal days follow the UTC timestamps in the database, so jobs fire on UTC too
+JOB_TIMEZONE = 'UTC'
+
 class SchedulerService:
     def __init__(self, bot):
         self.bot = bot
-        self.scheduler = BackgroundScheduler()
+        # Run jobs as coroutines on the bot's own event loop
+        self.scheduler = AsyncIOScheduler(event_loop=asyncio.get_event_loop())
         self.setup_jobs()
 
     def setup_jobs(self):
@@ -14,14 +22,14 @@ class SchedulerService:
         # Daily summary at midnight (00:00)
         self.scheduler.add_job(
             self.send_daily_summary,
-            CronTrigger(hour=0, minute=0),
+            CronTrigger(hour=0, minute=0, timezone=JOB_TIMEZONE),
             id='daily_summary'
         )
         
         # Meal logging reminder at 23:00
         self.scheduler.add_job(
             self.send_reminder,
-            CronTrigger(hour=23, minute=0),
+            CronTrigger(hour=23, minute=0, timezone=JOB_TIMEZONE),
             id='meal_reminder'
         )
 
@@ -33,18 +41,42 @@ class SchedulerService:
         """Stop the scheduler."""
         self.scheduler.shutdown()
 
+    async def _send_messages(self, messages):
+        """Send (chat_id, text) pairs concurrently, at most MAX_CONCURRENT_SENDS at a time."""
+        semaphore = asyncio.Semaphore(MAX_CONCURRENT_SENDS)
+
+        async def send(chat_id, text):
+            async with semaphore:
+                await self.bot.send_message(chat_id=chat_id, text=text)
+
+        results = await asyncio.gather(
+            *(send(chat_id, text) for chat_id, text in messages),
+            return_exceptions=True
+        )
+        for (chat_id, _), result in zip(messages, results):
+            if isinstance(result, Exception):
+                print(f"Error sending message to {chat_id}: {str(result)}")
+
     async def send_daily_summary(self):
         """Send daily calorie summary to all users."""
         try:
-            # Get all users
-            users = db.supabase.table("users").select("*").execute()
+            # The job runs at midnight, so summarize the day that just ended
+            day = datetime.utcnow().date() - timedelta(days=1)
+            
+            # Get all users and their totals for the day
+            users = await db.aget_all_users()
+            totals = await db.aall_daily_totals(day)
             
-            for user in users.data:
+            now = datetime.utcnow().isoformat()
+            summary_rows = []
+            messages = []
+            
+            for user in users:
                 if not user.get('user_id'):
                     continue
                 
-                # Calculate total calories for the day
-                total_calories = db.get_daily_total(user['user_id'])
+                # Look up total calories for the day
+                total_calories = totals.get(user['user_id'], 0)
                 target_met = total_calories <= user.get('daily_target', 2000)
                 
                 # Create summary message
@@ -55,18 +87,16 @@ class SchedulerService:
                     f"Status: {'✅ Target met!' if target_met else '⚠️ Target exceeded'}"
                 )
                 
-                # Log the summary
-                db.log_daily_summary(
-                    user['user_id'],
-                    total_calories,
-                    target_met
-                )
-                
-                # Send message to user
-                await self.bot.send_message(
-                    chat_id=user['user_id'],
-                    text=message
+                summary_rows.append(
+                    (user['user_id'], day.isoformat(), total_calories, 1 if target_met else 0, now)
                 )
+                messages.append((user['user_id'], message))
+            
+            # Log all summaries in a single transaction
+            await db.alog_daily_summaries_bulk(summary_rows)
+            
+            # Send messages to users
+            await self._send_messages(messages)
                 
         except Exception as e:
             print(f"Error sending daily summary: {str(e)}")
@@ -75,18 +105,15 @@ class SchedulerService:
         """Send reminder to users who haven't logged all meals."""
         try:
             # Get all users with reminders enabled
-            users = db.supabase.table("users") \
-                .select("*") \
-                .eq("reminder_enabled", True) \
-                .execute()
+            users = await db.aget_reminder_users()
+            messages = []
             
-            for user in users.data:
+            for user in users:
                 if not user.get('user_id'):
                     continue
                 
                 # Check if user has logged any meals today
-                meals = db.get_daily_meals(user['user_id'])
-                if not meals.data:
+                if not await db.auser_has_meals_today(user['user_id']):
                     message = (
                         "🔔 Reminder!\n\n"
                         "You haven't logged any meals today. "
@@ -94,14 +121,13 @@ class SchedulerService:
                         "Use /add to log manually or send a photo of your food."
                     )
                     
-                    # Send reminder
-                    await self.bot.send_message(
-                        chat_id=user['user_id'],
-                        text=message
-                    )
+                    messages.append((user['user_id'], message))
+            
+            # Send reminders
+            await self._send_messages(messages)
                     
         except Exception as e:
             print(f"Error sending reminder: {str(e)}")
 
-# Note: The scheduler instance will be created in main.py
-# when the bot is initialized 
\ No newline at end of file
+# Note: The scheduler instance will be created in main.py once the
+# bot's event loop is running 
\ No newline at end of file